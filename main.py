@@ -1,4 +1,7 @@
-import traceback
+import asyncio
+import json
+import os
+import time
 import aiohttp
 from pathlib import Path
 from datetime import datetime  # 供调试模式使用
@@ -13,6 +16,25 @@ import astrbot.api.message_components as Comp
 # 导入 APScheduler 库，用于定时任务
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
+# 本插件目录及插件根目录，导入时计算一次
+_MODULE_DIR = Path(__file__).resolve().parent
+_PLUG_PATH = _MODULE_DIR.parent
+_TEST_MD_PATH = _MODULE_DIR / "test.md"
+
+
+def _write_test_md(content: str):
+    """
+    写入调试文件 test.md，在线程池中调用以免阻塞事件循环。
+    """
+    _TEST_MD_PATH.write_text(content, encoding="utf-8")
+
+
+def _dump_test_data(data) -> str:
+    """
+    将调试数据序列化为 JSON 字符串，无法序列化的对象转为字符串。
+    """
+    return json.dumps(data, ensure_ascii=False, default=str)
+
 
 @register(
     "astrbot_plugin_update_manager",
@@ -31,12 +53,22 @@ class PluginUpdateManager(Star):
         self.black_plugin_list = self.config.get("black_plugin_list", [])
         self.white_plugin_list = self.config.get("white_plugin_list", [])
         self.admin_sid_list = self.config.get("admin_sid_list", [])
+        # 同时更新的插件数上限，未设置或 <=0 时有代理取 4，否则取 2，避免触发 GitHub 限流
+        max_parallel_updates = int(self.config.get("max_parallel_updates", 0) or 0)
+        if max_parallel_updates <= 0:
+            max_parallel_updates = 4 if self.proxy_address else 2
+        self._update_sem = asyncio.Semaphore(max_parallel_updates)
+        # 在线插件市场数据缓存 (获取时间, 数据)，只用于合并短时间内的连续检查，
+        # 有效期较短，避免手动检查时错过刚发布的新版本
+        self._online_plugins_cache: tuple[float, dict] | None = None
+        self._cache_ttl = 5 * 60
 
         if self.proxy_address:
-            logger.info(f"使用代理：{self.proxy_address}")
+            logger.info("使用代理：%s", self.proxy_address)
         else:
             logger.info("未设置代理。")
 
+        self.scheduler: AsyncIOScheduler | None = None
         if self.interval_hours:
             # 初始化 APScheduler 调度器
             self.scheduler = AsyncIOScheduler()
@@ -47,6 +79,10 @@ class PluginUpdateManager(Star):
                 hours=self.interval_hours,
                 id="scheduled_plugin_update",
                 name="Scheduled Plugin Update Check",
+                # 错过的多次执行合并为一次，且同一时间只运行一个检查
+                coalesce=True,
+                max_instances=1,
+                misfire_grace_time=max(60, int(60 * self.interval_hours)),
             )
             # 启动调度器
             self.scheduler.start()
@@ -75,76 +111,87 @@ class PluginUpdateManager(Star):
         """
         返回一个字符串，包含更新的结果摘要。
         """
-        # 检查所有必要的依赖是否成功导入
-
-        plug_path = Path(__file__).resolve().parent.parent
-        logger.info(f"插件目录：{plug_path}")
-        if not plug_path.is_dir():
-            error_msg = f"未找到插件目录 {plug_path}，无法执行更新。"
-            logger.error(f"错误：未找到插件目录 {plug_path}。")
+        logger.info("插件目录：%s", _PLUG_PATH)
+        if not os.path.isdir(_PLUG_PATH):
+            error_msg = f"未找到插件目录 {_PLUG_PATH}，无法执行更新。"
+            logger.error(f"错误：未找到插件目录 {_PLUG_PATH}。")
             return error_msg
 
-        update_summary_messages = []
-        error_msg = []
-        failed_plugins = []
-        successed_plugins = []
-
         try:
-            if self.test_mode:  # 调试模式
-                with open(
-                    Path(__file__).resolve().parent / "test.md", "w", encoding="utf-8"
-                ) as f:
-                    f.write(f"于{datetime.now()}记录\n ")
-                    logger.info("调试模式：已生成测试文件 test.md。")
-
             # 提取需要更新插件的名称列表，用于日志输出
             plugin_names_to_update = await self.get_need_update_plugins_list()
-            if not plugin_names_to_update:
-                message = "目前没有发现需要更新的插件。"
-                logger.info(f"{message}")
-                return message
-            logger.info(
-                f"发现 {len(plugin_names_to_update)} 个需要更新的插件：{plugin_names_to_update}。"
-            )
-            update_summary_messages.append(
-                f"发现 {len(plugin_names_to_update)} 个插件需要更新。"
-            )
+        except Exception as e:
+            # 单个插件的更新失败由 _update_one 处理，这里只兜底检查阶段的意外错误
+            logger.exception("插件更新流程中发生意外错误")
+            return f"插件更新流程异常终止: {e}。请检查机器人日志。"
 
-            # 遍历并逐个更新插件
-            for plugin_name_to_update in plugin_names_to_update:
-                try:
-                    logger.info(f"正在更新插件：{plugin_name_to_update}...")
-                    await self.context._star_manager.update_plugin(
-                        plugin_name=plugin_name_to_update,
-                        proxy=self.proxy_address,
-                    )
-                    # await self.context._star_manager.reload(specified_plugin_name=plugin_name_to_update)实测会自动重载插件，无需手动重新加载
-                    logger.info(f"插件 {plugin_name_to_update} 更新并已自动重新加载。")
-                    successed_plugins.append(plugin_name_to_update)
+        if plugin_names_to_update is None:
+            message = "无法获取在线插件市场数据，未能检查更新。"
+            logger.warning(message)
+            return message
+        if not plugin_names_to_update:
+            message = "目前没有发现需要更新的插件。"
+            logger.info(message)
+            return message
+        logger.info(
+            "发现 %d 个需要更新的插件：%s。",
+            len(plugin_names_to_update),
+            plugin_names_to_update,
+        )
 
-                except Exception as e:
-                    error_msg.append(f"更新插件 {plugin_name_to_update} 失败: {str(e)}")
-                    failed_plugins.append(plugin_name_to_update)
-                    logger.error(f"{error_msg}\n{traceback.format_exc()}")
+        # 并发更新所有插件，总耗时取决于最慢的一个而非全部之和；结果按输入顺序返回
+        # 未传 return_exceptions：_update_one 内部捕获 Exception，异常不会逃出上方收窄后的 try
+        results = await asyncio.gather(
+            *(self._update_one(name) for name in plugin_names_to_update)
+        )
+        successed_plugins = [name for name, error in results if error is None]
+        failed_plugins = [name for name, error in results if error is not None]
+        error_msg = [
+            f"更新插件 {name} 失败: {error}"
+            for name, error in results
+            if error is not None
+        ]
+        logger.info(
+            "更新完成: %d 成功 (%s), %d 失败 (%s)",
+            len(successed_plugins),
+            successed_plugins,
+            len(failed_plugins),
+            failed_plugins,
+        )
+
+        # 构建最终的回复消息
+        failed_part = (
+            f"\n\n注意：部分插件更新失败：{failed_plugins}。\n" + "\n".join(error_msg)
+            if error_msg
+            else ""
+        )
+        not_found_part = (
+            f"\n\n注意：插件{self.not_found_plugins_names} 名称不一致，未能判断是否需要更新。\n"
+            if self.not_found_plugins_names
+            else ""
+        )
+        return (
+            f"发现 {len(plugin_names_to_update)} 个插件需要更新。"
+            f"{failed_part}{not_found_part}"
+            f"\n成功更新 {len(successed_plugins)} 个插件。\n{successed_plugins}"
+        )
 
-            # 构建最终的回复消息
-            final_reply_to_user = "\n".join(update_summary_messages)
-            if error_msg:
-                final_reply_to_user += (
-                    f"\n\n注意：部分插件更新失败：{str(failed_plugins)}。\n"
+    async def _update_one(self, plugin_name: str) -> tuple[str, str | None]:
+        """
+        更新单个插件，返回 (插件名, 错误信息)，更新成功时错误信息为 None。
+        """
+        try:
+            async with self._update_sem:
+                await self.context._star_manager.update_plugin(
+                    plugin_name=plugin_name,
+                    proxy=self.proxy_address,
                 )
-                final_reply_to_user += "\n".join(error_msg)
-            if self.not_found_plugins_names:
-                final_reply_to_user += f"\n\n注意：插件{str(self.not_found_plugins_names)} 名称不一致，未能判断是否需要更新。\n"
-            final_reply_to_user += (
-                f"\n成功更新 {len(successed_plugins)} 个插件。\n{successed_plugins}"
-            )
-            return final_reply_to_user
+            # await self.context._star_manager.reload(specified_plugin_name=plugin_name)实测会自动重载插件，无需手动重新加载
+            return plugin_name, None
 
         except Exception as e:
-            error_msg = f"插件更新流程中发生意外错误: {traceback.format_exc()}"
-            logger.error(f"{error_msg}")
-            return f"插件更新流程异常终止: {e}。请检查机器人日志。"
+            logger.exception("更新插件 %s 失败", plugin_name)
+            return plugin_name, str(e)
 
     @filter.permission_type(filter.PermissionType.ADMIN)
     @filter.command("更新所有插件", alias={"updateallplugins", "更新全部插件"})
@@ -187,9 +234,25 @@ class PluginUpdateManager(Star):
         logger.warning("远程插件市场数据获取失败")
         return None
 
+    async def _get_online_plugins(self):
+        """
+        获取在线插件市场数据，缓存未过期时直接返回缓存，避免重复请求远程地址。
+        """
+        now = time.monotonic()
+        if self._online_plugins_cache is not None:
+            cached_at, cached_data = self._online_plugins_cache
+            if now - cached_at < self._cache_ttl:
+                logger.info("使用缓存的远程插件市场数据")
+                return cached_data
+        remote_data = await self._fetch_online_plugins()
+        if remote_data:  # 获取失败时不缓存，下次重新请求
+            self._online_plugins_cache = (now, remote_data)
+        return remote_data
+
     async def get_need_update_plugins_list(self):
         """
         获取本地插件列表，并与在线版本进行比较，返回需要更新的插件名列表。
+        无法获取在线插件市场数据时返回 None。
         """
         self.not_found_plugins_data = []
         self.not_found_plugins_names = []
@@ -211,43 +274,42 @@ class PluginUpdateManager(Star):
                     "online_version": "",
                 }
             )
-        online_plugins_data = await self._fetch_online_plugins()
-        if self.test_mode:  # 调试模式
-            with open(
-                Path(__file__).resolve().parent / "test.md", "w", encoding="utf-8"
-            ) as f:
-                f.write(f"于{datetime.now()}记录\n\n")
-                f.write(f"本地插件列表：{local_plugins_list}\n\n")
-                f.write(f"在线插件市场数据：{online_plugins_data}\n\n")
+        online_plugins_data = await self._get_online_plugins()
+        # 调试模式下在比较前记录本地列表的原始状态
+        local_snapshot = _dump_test_data(local_plugins_list) if self.test_mode else ""
         if not online_plugins_data:
             logger.warning("无法获取在线插件数据，跳过版本比较。")
-            return local_plugins_list
+            if self.test_mode:  # 调试模式
+                await self._dump_test_md(
+                    local_snapshot, online_plugins_data, local_plugins_list
+                )
+            return None  # 与“没有需要更新的插件”区分开
+        need_update_names = []  # 在比较的同时收集需要更新的插件名，避免再次遍历
+        # 循环中频繁调用的方法绑定为局部变量，省去每次的属性查找
+        online_get = online_plugins_data.get
+        compare_version = VersionComparator.compare_version
         for p in local_plugins_list:
             if p_name := p.get("name"):
                 online_plugin_data = (
-                    online_plugins_data.get(p_name)
-                    or online_plugins_data.get(p_name.lower())
-                    or online_plugins_data.get(p_name.replace("astrbot_plugin_", ""))
-                    or online_plugins_data.get(f"astrbot_plugin_{p_name}")
+                    online_get(p_name)
+                    or online_get(p_name.lower())
+                    or online_get(p_name.replace("astrbot_plugin_", ""))
+                    or online_get(f"astrbot_plugin_{p_name}")
                 )
             if not online_plugin_data and p.get("repo"):
-                online_plugin_data = online_plugins_data.get(p["repo"].split("/")[-1])
+                online_plugin_data = online_get(p["repo"].split("/")[-1])
 
             if online_plugin_data:
                 p["online_version"] = online_plugin_data.get("version", "")
                 try:
-                    if (
-                        VersionComparator.compare_version(
-                            p["version"], p["online_version"]
-                        )
-                        == -1
-                    ):
-                        p["is_updatable"] = True
-                    else:
-                        p["is_updatable"] = False
+                    p["is_updatable"] = (
+                        compare_version(p["version"], p["online_version"]) == -1
+                    )
                 except Exception as e:
                     logger.error(f"比较插件 {p['name']} 的版本时出错: {e}")
                     p["is_updatable"] = False  # 发生错误时，保守地认为不可更新
+                if p["is_updatable"]:
+                    need_update_names.append(p["name"])
             elif (
                 "astrbot-" in p["name"]
                 or p["name"] == "astrbot"
@@ -255,21 +317,36 @@ class PluginUpdateManager(Star):
             ):
                 continue  # 跳过系统插件
             else:
-                logger.warning(f"插件 {p['name']} 不在在线插件市场中。")
+                logger.warning("插件 %s 不在在线插件市场中。", p["name"])
                 self.not_found_plugins_names.append(p["name"])
                 self.not_found_plugins_data.append(p)
         if self.test_mode:  # 调试模式
-            with open(
-                Path(__file__).resolve().parent / "test.md", "a", encoding="utf-8"
-            ) as f:
-                f.write(f"最终列表：{local_plugins_list}\n\n")
-                f.write(f"名称不一致的插件信息：{self.not_found_plugins_data}\n\n")
-        return [p["name"] for p in local_plugins_list if p["is_updatable"]]
+            await self._dump_test_md(
+                local_snapshot, online_plugins_data, local_plugins_list
+            )
+        return need_update_names
+
+    async def _dump_test_md(
+        self, local_snapshot: str, online_plugins_data, local_plugins_list: list
+    ):
+        """
+        调试模式下将本次检查的本地列表、在线数据与比较结果写入 test.md。
+        """
+        content = (
+            f"于{datetime.now()}记录\n\n"
+            f"本地插件列表：{local_snapshot}\n\n"
+            f"在线插件市场数据：{_dump_test_data(online_plugins_data)}\n\n"
+            f"最终列表：{_dump_test_data(local_plugins_list)}\n\n"
+            f"名称不一致的插件信息：{_dump_test_data(self.not_found_plugins_data)}\n\n"
+        )
+        await asyncio.to_thread(_write_test_md, content)
+        logger.info("调试模式：已生成测试文件 test.md。")
 
     async def terminate(self):
         """
         插件终止时（例如：插件被禁用或机器人关闭），关闭 APScheduler 定时任务。
         """
-        if self.scheduler.running:
-            self.scheduler.shutdown()  # 关闭调度器
+        if self.scheduler is not None and self.scheduler.running:
+            # 关闭调度器，不等待正在执行的检查任务
+            self.scheduler.shutdown(wait=False)
             logger.info("定时任务调度器已关闭。")